@@ -1,17 +1,23 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
 import google.generativeai as genai
-import json
+import orjson
 import sqlite3
 import warnings
 import os
+import queue
 import re
 from dotenv import load_dotenv
 from enum import Enum
 from contextlib import contextmanager
+from functools import lru_cache
+from collections import deque
+import random
+import threading
+import time
 
 # Load environment variables
 load_dotenv()
@@ -25,6 +31,42 @@ if not api_key:
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 os.environ['GRPC_PYTHON_LOG_LEVEL'] = 'error'
 
+DB_NAME = "math_questions.db"
+DB_POOL_SIZE = 5
+DB_POOL_TIMEOUT = 30
+DB_MMAP_SIZE = 268435456
+WAL_CHECKPOINT_INTERVAL = 300
+
+QUESTION_PROMPT = """Create a {difficulty} level {topic} question with multiple choice options.
+Respond with only a JSON object formatted exactly like this example:
+{{
+    "question": "Solve for x: 4x + 6 = 26",
+    "options": [
+        {{"text": "x = 5", "is_correct": true}},
+        {{"text": "x = 4", "is_correct": false}},
+        {{"text": "x = 6", "is_correct": false}},
+        {{"text": "x = 7", "is_correct": false}}
+    ],
+    "solution_steps": [
+        "1. Subtract 6 from both sides: 4x = 20",
+        "2. Divide both sides by 4: x = 5"
+    ],
+    "explanation": "This is a linear equation. We isolate x by first moving all non-x terms to the right side, then dividing both sides by the coefficient of x."
+}}
+"""
+
+# Matches the outermost JSON object in the model response
+_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Recently generated questions are reused to avoid an LLM call on every request
+QUESTION_CACHE_SIZE = 32
+QUESTION_CACHE_TTL = 3600
+QUESTION_CACHE_HIT_RATE = 0.7
+
+# Student attempts are buffered and written in batches
+ATTEMPT_FLUSH_SIZE = 100
+ATTEMPT_FLUSH_INTERVAL = 0.25
+
 class MathTopic(str, Enum):
     ALGEBRA = "algebra"
     GEOMETRY = "geometry"
@@ -40,6 +82,7 @@ class Difficulty(str, Enum):
 class QuestionRequest(BaseModel):
     topic: MathTopic
     difficulty: Difficulty
+    refresh: bool = False
 
 class Answer(BaseModel):
     text: str
@@ -65,23 +108,63 @@ class SubmissionResponse(BaseModel):
 class DatabaseError(Exception):
     pass
 
+@lru_cache(maxsize=1024)
+def load_solution_steps(question_id: int, raw: str) -> tuple[str, ...]:
+    # Stored steps never change for a question, so the parsed form is reused
+    return tuple(orjson.loads(raw))
+
 class MathTutorAPI:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, db_name: str = DB_NAME, pool_size: int = DB_POOL_SIZE):
         if not api_key:
             raise ValueError("API key is required")
             
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel("gemini-pro")
+        self.model = genai.GenerativeModel("gemini-pro", generation_config={"temperature": 0.7})
+        self.db_name = db_name
+        self.pool_size = pool_size
+        self._pool = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(self._open_connection())
+        self._q_cache: dict[tuple[str, str], deque] = {}
+        self._q_cache_lock = threading.Lock()
+        self._attempt_buf: list[tuple] = []
+        self._buf_lock = threading.Lock()
+        self._last_flush = time.monotonic()
         self.setup_database()
 
+    def _open_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        return conn
+
     @contextmanager
     def get_db_connection(self):
-        conn = sqlite3.connect("math_questions.db")
-        sqlite3.register_adapter(datetime, lambda x: x.isoformat())
+        try:
+            conn = self._pool.get(timeout=DB_POOL_TIMEOUT)
+        except queue.Empty:
+            raise DatabaseError("Timed out waiting for a database connection")
         try:
             yield conn
         finally:
-            conn.close()
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+
+    def checkpoint_wal(self):
+        with self.get_db_connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def pool_health(self) -> dict:
+        idle = self._pool.qsize()
+        return {
+            "pool_size": self.pool_size,
+            "active": self.pool_size - idle,
+            "idle": idle
+        }
 
     def setup_database(self):
         try:
@@ -107,162 +190,355 @@ class MathTutorAPI:
                     question_id INTEGER,
                     selected_answer TEXT,
                     is_correct BOOLEAN,
-                    attempt_date TIMESTAMP,
+                    attempt_date INTEGER,
                     FOREIGN KEY (question_id) REFERENCES questions (id)
                 )
                 ''')
+                # Attempt dates used to be ISO strings in local time; store them as Unix seconds
+                cursor.execute('''
+                UPDATE student_attempts
+                SET attempt_date = CAST(strftime('%s', attempt_date, 'utc') AS INTEGER)
+                WHERE typeof(attempt_date) = 'text'
+                ''')
+                # Covers the per-question count/sum used to backfill question_stats
+                cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_attempts_qid_correct ON student_attempts (question_id, is_correct)
+                ''')
+                # Used to refill the question cache for a topic and difficulty
+                cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_questions_topic_diff ON questions (topic, difficulty)
+                ''')
+
+                # Running totals per question, kept in sync when attempts are flushed
+                cursor.execute('''
+                CREATE TABLE IF NOT EXISTS question_stats (
+                    question_id INTEGER PRIMARY KEY,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    correct INTEGER NOT NULL DEFAULT 0
+                )
+                ''')
+
+                # Collapse duplicates stored before the unique index existed so it can be created
+                self._merge_duplicate_questions(conn)
+                cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS uq_questions ON questions (topic, difficulty, question_text)
+                ''')
+                # Backfill totals for attempts recorded before the table existed
+                cursor.execute('''
+                INSERT OR IGNORE INTO question_stats (question_id, total, correct)
+                SELECT question_id, COUNT(*), SUM(CASE WHEN is_correct THEN 1 ELSE 0 END)
+                FROM student_attempts
+                GROUP BY question_id
+                ''')
                 conn.commit()
         except sqlite3.Error as e:
             raise DatabaseError(f"Failed to setup database: {str(e)}")
 
-    def validate_question_response(self, question_data: dict) -> bool:
+    def _merge_duplicate_questions(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT id, keep_id
+        FROM (
+            SELECT id, MIN(id) OVER (PARTITION BY topic, difficulty, question_text) AS keep_id
+            FROM questions
+            WHERE topic IS NOT NULL AND difficulty IS NOT NULL AND question_text IS NOT NULL
+        )
+        WHERE id != keep_id
+        ''')
+        duplicates = cursor.fetchall()
+        if not duplicates:
+            return
+
+        # Point attempts at the oldest copy of each question, then drop the extras
+        affected_ids = {question_id for pair in duplicates for question_id in pair}
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.executemany('''
+        UPDATE student_attempts SET question_id = ? WHERE question_id = ?
+        ''', [(keep_id, question_id) for question_id, keep_id in duplicates])
+        cursor.executemany('''
+        DELETE FROM questions WHERE id = ?
+        ''', [(question_id,) for question_id, _ in duplicates])
+        # Totals for the affected questions are rebuilt by the question_stats backfill
+        cursor.executemany('''
+        DELETE FROM question_stats WHERE question_id = ?
+        ''', [(question_id,) for question_id in affected_ids])
+        conn.commit()
+
+    def _flush_attempts(self, conn: sqlite3.Connection, force: bool = False):
+        # Callers must hold self._buf_lock
+        if not self._attempt_buf:
+            return
+        if not force and len(self._attempt_buf) < ATTEMPT_FLUSH_SIZE \
+                and time.monotonic() - self._last_flush < ATTEMPT_FLUSH_INTERVAL:
+            return
+
+        rows = self._attempt_buf
+        self._attempt_buf = []
+        stats = {}
+        for question_id, _, is_correct, _ in rows:
+            total, correct = stats.get(question_id, (0, 0))
+            stats[question_id] = (total + 1, correct + (1 if is_correct else 0))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany('''
+            INSERT INTO student_attempts 
+            (question_id, selected_answer, is_correct, attempt_date)
+            VALUES (?, ?, ?, ?)
+            ''', rows)
+            conn.executemany('''
+            INSERT INTO question_stats (question_id, total, correct)
+            VALUES (?, ?, ?)
+            ON CONFLICT (question_id) DO UPDATE SET
+                total = total + excluded.total,
+                correct = correct + excluded.correct
+            ''', [(question_id, total, correct) for question_id, (total, correct) in stats.items()])
+            conn.commit()
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            # Keep the rows so the next flush can retry them
+            self._attempt_buf[:0] = rows
+            raise DatabaseError(f"Failed to flush attempts: {str(e)}")
+        self._last_flush = time.monotonic()
+
+    def flush_attempts(self, force: bool = False):
+        if not self._attempt_buf:
+            return
+        # Take the connection before the lock, as submit_answer does, so the
+        # flusher never holds the lock while waiting on an exhausted pool
+        with self.get_db_connection() as conn:
+            with self._buf_lock:
+                self._flush_attempts(conn, force)
+
+    def validate_question_response(self, question_data: dict) -> Optional[int]:
+        # Returns the index of the single correct option, or None if the response is invalid
         required_fields = ['question', 'options', 'solution_steps', 'explanation']
         if not all(field in question_data for field in required_fields):
-            return False
+            return None
         
         if not isinstance(question_data['options'], list) or len(question_data['options']) < 2:
-            return False
+            return None
             
-        correct_answers = sum(1 for opt in question_data['options'] if opt.get('is_correct'))
-        if correct_answers != 1:
-            return False
+        correct_idx = None
+        for idx, opt in enumerate(question_data['options']):
+            if opt.get('is_correct'):
+                if correct_idx is not None:
+                    return None
+                correct_idx = idx
             
-        return True
-
-    def generate_question(self, topic: MathTopic, difficulty: Difficulty) -> Question:
-        prompt = f"""
-        Create a {difficulty.value} level {topic.value} question with multiple choice options.
-        Format your response exactly like this example:
-        {{
-            "question": "Solve for x: 4x + 6 = 26",
-            "options": [
-                {{"text": "x = 5", "is_correct": true}},
-                {{"text": "x = 4", "is_correct": false}},
-                {{"text": "x = 6", "is_correct": false}},
-                {{"text": "x = 7", "is_correct": false}}
-            ],
-            "solution_steps": [
-                "1. Subtract 6 from both sides: 4x = 20",
-                "2. Divide both sides by 4: x = 5"
-            ],
-            "explanation": "This is a linear equation. We isolate x by first moving all non-x terms to the right side, then dividing both sides by the coefficient of x."
-        }}
-        """
-        
-        try:
-            response = self.model.generate_content(prompt)
-            if not response.text:
-                raise ValueError("Empty response from AI model")
+        return correct_idx
 
-            response_text = response.text
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
-            
-            if start_idx == -1 or end_idx == 0:
-                raise ValueError("Invalid JSON format in response")
-                
-            json_str = response_text[start_idx:end_idx]
-            question_data = json.loads(json_str)
+    def cache_question_id(self, topic: MathTopic, difficulty: Difficulty, question_id: int):
+        key = (topic.value, difficulty.value)
+        with self._q_cache_lock:
+            bucket = self._q_cache.setdefault(key, deque(maxlen=QUESTION_CACHE_SIZE))
+            bucket.append((question_id, time.monotonic()))
+
+    def warm_question_cache(self, topic: MathTopic, difficulty: Difficulty):
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT id
+            FROM questions
+            WHERE topic = ? AND difficulty = ?
+            ORDER BY id DESC
+            LIMIT ?
+            ''', (topic.value, difficulty.value, QUESTION_CACHE_SIZE))
+            rows = cursor.fetchall()
+
+        key = (topic.value, difficulty.value)
+        now = time.monotonic()
+        with self._q_cache_lock:
+            if key in self._q_cache:
+                return
+            bucket = self._q_cache[key] = deque(maxlen=QUESTION_CACHE_SIZE)
+            bucket.extend((row[0], now) for row in reversed(rows))
+
+    def get_cached_question_id(self, topic: MathTopic, difficulty: Difficulty) -> Optional[int]:
+        key = (topic.value, difficulty.value)
+        if key not in self._q_cache:
+            # First request for this bucket since startup; load stored questions
+            self.warm_question_cache(topic, difficulty)
+        now = time.monotonic()
+        with self._q_cache_lock:
+            bucket = self._q_cache.get(key)
+            if not bucket:
+                return None
+            # Entries are appended in order, so expired ones are always at the front
+            while bucket and now - bucket[0][1] > QUESTION_CACHE_TTL:
+                bucket.popleft()
+            if not bucket:
+                return None
+            return random.choice(bucket)[0]
+
+    def load_question(self, question_id: int) -> Optional[Question]:
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT question_text, options, solution_steps, explanation
+            FROM questions
+            WHERE id = ?
+            ''', (question_id,))
+            row = cursor.fetchone()
+
+        if not row:
+            return None
+
+        question_text, options, solution_steps, explanation = row
+        return Question(
+            id=question_id,
+            question_text=question_text,
+            options=orjson.loads(options),
+            solution_steps=load_solution_steps(question_id, solution_steps),
+            explanation=explanation
+        )
+
+    def generate_response_text(self, prompt: str) -> str:
+        # Blocking call to the AI model; keep it off the event loop
+        response = self.model.generate_content(prompt)
+        if not response.text:
+            raise ValueError("Empty response from AI model")
+        return response.text
+
+    def store_question(self, topic: MathTopic, difficulty: Difficulty, response_text: str) -> Question:
+        match = _JSON_RE.search(response_text)
+        if not match:
+            raise ValueError("Invalid JSON format in response")
             
-            if not self.validate_question_response(question_data):
-                raise ValueError("Invalid question format in response")
+        json_str = match.group(0)
+        question_data = orjson.loads(json_str)
+        
+        correct_idx = self.validate_question_response(question_data)
+        if correct_idx is None:
+            raise ValueError("Invalid question format in response")
 
-            # Store question in database
-            with self.get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                INSERT INTO questions 
-                (topic, difficulty, question_text, correct_answer, options, solution_steps, explanation)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    topic.value,
-                    difficulty.value,
-                    question_data['question'],
-                    next(opt['text'] for opt in question_data['options'] if opt['is_correct']),
-                    json.dumps(question_data['options']),
-                    json.dumps(question_data['solution_steps']),
-                    question_data['explanation']
-                ))
+        # Store question in database
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute('''
+            INSERT INTO questions 
+            (topic, difficulty, question_text, correct_answer, options, solution_steps, explanation)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+            ''', (
+                topic.value,
+                difficulty.value,
+                question_data['question'],
+                question_data['options'][correct_idx]['text'],
+                orjson.dumps(question_data['options']).decode(),
+                orjson.dumps(question_data['solution_steps']).decode(),
+                question_data['explanation']
+            ))
+            inserted = cursor.rowcount > 0
+            if inserted:
                 question_id = cursor.lastrowid
-                conn.commit()
-            
-            return Question(
-                id=question_id,
-                question_text=question_data['question'],
-                options=question_data['options'],
-                solution_steps=question_data['solution_steps'],
-                explanation=question_data['explanation']
-            )
-        except json.JSONDecodeError as e:
+            else:
+                # The model repeated an existing question; reuse the stored row
+                cursor.execute('''
+                SELECT id
+                FROM questions
+                WHERE topic = ? AND difficulty = ? AND question_text = ?
+                ''', (topic.value, difficulty.value, question_data['question']))
+                question_id = cursor.fetchone()[0]
+            conn.commit()
+
+        if not inserted:
+            return self.load_question(question_id)
+
+        self.cache_question_id(topic, difficulty, question_id)
+        
+        return Question(
+            id=question_id,
+            question_text=question_data['question'],
+            options=question_data['options'],
+            solution_steps=question_data['solution_steps'],
+            explanation=question_data['explanation']
+        )
+
+    def generate_question(self, topic: MathTopic, difficulty: Difficulty, refresh: bool = False) -> Question:
+        try:
+            # Serve a recently generated question when possible to skip the LLM call
+            if not refresh and random.random() < QUESTION_CACHE_HIT_RATE:
+                question_id = self.get_cached_question_id(topic, difficulty)
+                if question_id is not None:
+                    cached_question = self.load_question(question_id)
+                    if cached_question:
+                        return cached_question
+
+            prompt = QUESTION_PROMPT.format(difficulty=difficulty.value, topic=topic.value)
+            response_text = self.generate_response_text(prompt)
+            return self.store_question(topic, difficulty, response_text)
+        except orjson.JSONDecodeError as e:
             raise HTTPException(status_code=500, detail=f"Invalid response format: {str(e)}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error generating question: {str(e)}")
 
-    def submit_answer(self, question_id: int, selected_answer: str) -> SubmissionResponse:
+    def submit_answer(self, question_id: int, selected_answer: str, conn: sqlite3.Connection) -> SubmissionResponse:
         try:
-            with self.get_db_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Get question details
-                cursor.execute('''
-                SELECT correct_answer, solution_steps, explanation 
-                FROM questions 
-                WHERE id = ?
-                ''', (question_id,))
-                question_data = cursor.fetchone()
-                
-                if not question_data:
-                    raise HTTPException(status_code=404, detail="Question not found")
-                
-                correct_answer, solution_steps, explanation = question_data
-                is_correct = selected_answer == correct_answer
-                
-                # Validate selected_answer
-                if not isinstance(selected_answer, str):
-                    raise HTTPException(status_code=400, detail="selected_answer must be a string")
-                
-                # Store attempt
+            cursor = conn.cursor()
+            
+            # Get question details
+            cursor.execute('''
+            SELECT correct_answer, solution_steps, explanation 
+            FROM questions 
+            WHERE id = ?
+            ''', (question_id,))
+            question_data = cursor.fetchone()
+            
+            if not question_data:
+                raise HTTPException(status_code=404, detail="Question not found")
+            
+            correct_answer, solution_steps, explanation = question_data
+            is_correct = selected_answer == correct_answer
+            
+            # Validate selected_answer
+            if not isinstance(selected_answer, str):
+                raise HTTPException(status_code=400, detail="selected_answer must be a string")
+            
+            with self._buf_lock:
+                # Buffer attempt; it is written with the next batch
+                attempt = (question_id, selected_answer, is_correct, int(time.time()))
+                self._attempt_buf.append(attempt)
                 try:
-                    cursor.execute('''
-                    INSERT INTO student_attempts 
-                    (question_id, selected_answer, is_correct, attempt_date)
-                    VALUES (?, ?, ?, ?)
-                    ''', (question_id, selected_answer, is_correct, datetime.now()))
-                    conn.commit()
-                except sqlite3.Error as e:
+                    self._flush_attempts(conn)
+                except DatabaseError as e:
+                    # The failed batch is kept for retry, but this request reports failure,
+                    # so drop its attempt to avoid counting it twice if the client retries
+                    self._attempt_buf.remove(attempt)
                     raise HTTPException(status_code=500, detail=f"Failed to insert attempt: {str(e)}")
                 
                 # Calculate performance stats
                 cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_attempts,
-                    SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as correct_attempts
-                FROM student_attempts 
+                SELECT total, correct
+                FROM question_stats 
                 WHERE question_id = ?
                 ''', (question_id,))
-                stats = cursor.fetchone()
-                
-                if not stats or len(stats) != 2:
-                    raise HTTPException(status_code=500, detail="Invalid performance stats data")
-                
-                performance_stats = {
-                    "total_attempts": stats[0],
-                    "correct_attempts": stats[1],
-                    "success_rate": round((stats[1] / stats[0]) * 100, 2) if stats[0] > 0 else 0
-                }
+                stats = cursor.fetchone() or (0, 0)
                 
-                # Parse solution_steps
-                try:
-                    solution_steps_parsed = json.loads(solution_steps)
-                except json.JSONDecodeError as e:
-                    raise HTTPException(status_code=500, detail=f"Failed to parse solution_steps: {str(e)}")
-                
-                return SubmissionResponse(
-                    is_correct=is_correct,
-                    explanation=explanation,
-                    solution_steps=solution_steps_parsed,
-                    performance_stats=performance_stats
-                )
+                # Include attempts that have not been flushed yet
+                pending = [row[2] for row in self._attempt_buf if row[0] == question_id]
+            
+            total_attempts = stats[0] + len(pending)
+            correct_attempts = stats[1] + sum(1 for correct in pending if correct)
+            performance_stats = {
+                "total_attempts": total_attempts,
+                "correct_attempts": correct_attempts,
+                "success_rate": round((correct_attempts / total_attempts) * 100, 2) if total_attempts > 0 else 0
+            }
+            
+            # Parse solution_steps
+            try:
+                solution_steps_parsed = load_solution_steps(question_id, solution_steps)
+            except orjson.JSONDecodeError as e:
+                raise HTTPException(status_code=500, detail=f"Failed to parse solution_steps: {str(e)}")
+            
+            return SubmissionResponse(
+                is_correct=is_correct,
+                explanation=explanation,
+                solution_steps=solution_steps_parsed,
+                performance_stats=performance_stats
+            )
         except sqlite3.Error as e:
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
         except Exception as e:
@@ -282,13 +558,55 @@ app.add_middleware(
 # Initialize tutor after FastAPI app creation
 tutor = MathTutorAPI(api_key=api_key)
 
+async def flush_attempts_periodically():
+    while True:
+        await asyncio.sleep(ATTEMPT_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(tutor.flush_attempts)
+        except DatabaseError:
+            # Rows stay buffered and are retried on the next tick
+            pass
+
+async def checkpoint_wal_periodically():
+    while True:
+        await asyncio.sleep(WAL_CHECKPOINT_INTERVAL)
+        try:
+            await asyncio.to_thread(tutor.checkpoint_wal)
+        except (DatabaseError, sqlite3.Error):
+            # A busy database just means the next checkpoint does the work
+            pass
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.attempt_flusher = asyncio.create_task(flush_attempts_periodically())
+    app.state.wal_checkpointer = asyncio.create_task(checkpoint_wal_periodically())
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    app.state.attempt_flusher.cancel()
+    app.state.wal_checkpointer.cancel()
+    tutor.flush_attempts(force=True)
+
+def get_db():
+    # One pooled connection per request, released once the response is done
+    try:
+        with tutor.get_db_connection() as conn:
+            yield conn
+    except DatabaseError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
 @app.post("/questions", response_model=Question)
 async def create_question(request: QuestionRequest):
-    return tutor.generate_question(request.topic, request.difficulty)
+    # Model and database calls block, so run them in a worker thread
+    return await asyncio.to_thread(tutor.generate_question, request.topic, request.difficulty, request.refresh)
 
 @app.post("/submit", response_model=SubmissionResponse)
-async def submit_answer(submission: SubmissionRequest):
-    return tutor.submit_answer(submission.question_id, submission.selected_answer)
+async def submit_answer(submission: SubmissionRequest, db: sqlite3.Connection = Depends(get_db)):
+    return await asyncio.to_thread(tutor.submit_answer, submission.question_id, submission.selected_answer, db)
+
+@app.get("/pool-health")
+async def pool_health():
+    return tutor.pool_health()
 
 if __name__ == "__main__":
     import uvicorn